@@ -1,21 +1,24 @@
 import asyncio
-import json
 import logging.handlers
 import os
-from dataclasses import asdict
 from datetime import datetime
 
 import auraxium
+import orjson
 from auraxium import event
 from auraxium.endpoints import NANITE_SYSTEMS
 from dotenv import load_dotenv
 from prometheus_client import Counter, Enum, Gauge, Info, start_http_server
-from pydantic.json import pydantic_encoder
 
 from constants import models
 from constants.typings import UniqueEventId
 from constants.utils import CustomFormatter, is_docker
-from services import Alert, Rabbit
+from services import alert, rabbit
+
+try:
+    import uvloop
+except ImportError:  # uvloop does not support Windows
+    uvloop = None
 
 # Change secrets variables accordingly
 if is_docker() is False:  # Use .env file for secrets
@@ -26,6 +29,7 @@ APP_VERSION = os.getenv('APP_VERSION', 'dev')
 API_KEY = os.getenv('API_KEY', 's:example')
 RABBITMQ_ENABLED = os.getenv('RABBITMQ_ENABLED', 'True')
 RABBITMQ_URL = os.getenv('RABBITMQ_URL', None)
+RABBITMQ_PERSISTENT = os.getenv('RABBITMQ_PERSISTENT', 'False')
 MONGODB_URL = os.getenv('MONGODB_URL', None)
 MONGODB_DB = os.getenv('MONGODB_DB', 'warpgate')
 MONGODB_COLLECTION = os.getenv('MONGODB_COLLECTION', 'alerts')
@@ -38,10 +42,6 @@ handler = logging.StreamHandler()
 handler.setFormatter(CustomFormatter())
 log.addHandler(handler)
 
-
-rabbit = Rabbit()
-alert = Alert()
-
 alert_service = Enum(
     name='alert_service_state',
     documentation='state of the alert service',
@@ -75,7 +75,12 @@ async def start_services() -> None:
     if RABBITMQ_ENABLED == 'True':
         if not rabbit.is_ready:
             rabbit_service.state('starting')
-            await rabbit.setup(RABBITMQ_URL)
+            # Track broker outages, the robust connection reconnects by itself
+            rabbit.add_state_callbacks(
+                on_close=lambda *_: rabbit_service.state('stopped'),
+                on_reconnect=lambda *_: rabbit_service.state('running'),
+            )
+            await rabbit.setup(RABBITMQ_URL, persistent=RABBITMQ_PERSISTENT == 'True')
 
         log.info('RabbitMQ Service ready!')
         rabbit_service.state('running')
@@ -100,18 +105,47 @@ async def start_services() -> None:
 async def purge_stale_alerts() -> None:
     """Removes alerts from the database that are older than 5400s (1h30m)"""
     max_age = datetime.utcnow().timestamp() - 5400  # Current POSIX timestamp minus 1h30m
-    # List of alerts where timestamp < max_age
-    stale_alerts = await alert.read_many(length=30, query={'timestamp': {'$lt': max_age}})
-    if len(stale_alerts) > 0:
-        log.info(f'Found {len(stale_alerts)} stale alert(s) in the database. Removing...')
-        deleted_count = 0
-        for i in stale_alerts:
-            deleted_count += await alert.remove(event_id=i['id'])
-        log.info(f'Stale alerts removed: {deleted_count}')
+    # Delete every alert where timestamp < max_age in a single round-trip
+    deleted_count = await alert.remove_many(query={'timestamp': {'$lt': max_age}})
+    if deleted_count > 0:
+        log.info('Stale alerts removed: %s', deleted_count)
+
+
+async def publish_event(unique_id: str, payload: bytes) -> None:
+    """Publishes a serialized MetagameEvent to RabbitMQ, if enabled"""
+    if RABBITMQ_ENABLED == 'True':
+        if await rabbit.publish(payload):
+            log.info('Event %s published', unique_id)
+        else:
+            log.warning('Event %s held until RabbitMQ reconnects', unique_id)
+
+
+async def create_alert(unique_id: str, payload: bytes) -> None:
+    """Adds a started alert to the database"""
+    # Reuse the serialized payload rather than walking the dataclass again
+    result = await alert.create(orjson.loads(payload))
+
+    log.info('Created alert %s', unique_id)
+    log.debug('Inserted document %s', result)
+
+
+async def remove_alert(unique_id: str, payload: bytes) -> None:
+    """Removes an ended or cancelled alert from the database"""
+    await alert.remove(event_id=unique_id)
+
+    log.info('Removed alert %s', unique_id)
+
+
+# Database handler for each MetagameEvent state, other states are only published
+STATE_HANDLERS = {
+    'started': create_alert,
+    'ended': remove_alert,
+    'cancelled': remove_alert,
+}
 
 
 async def main() -> None:
-    log.info(f'Starting ESS client version: {APP_VERSION}')
+    log.info('Starting ESS client version: %s', APP_VERSION)
 
     await start_services()
 
@@ -125,10 +159,12 @@ async def main() -> None:
         async def on_metagame_event(evt: event.MetagameEvent) -> None:
             unique_id = str(UniqueEventId(evt.world_id, evt.instance_id))
 
-            log.info(f'Received {evt.event_name} id: {unique_id}')
+            log.info('Received %s id: %s', evt.event_name, unique_id)
+
+            timestamp = evt.timestamp.timestamp()
 
             total_events.inc(1)
-            last_event_time.set(evt.timestamp.timestamp())
+            last_event_time.set(timestamp)
 
             event_data = models.MetagameEvent(
                 id=unique_id,
@@ -140,29 +176,22 @@ async def main() -> None:
                 tr=evt.faction_tr,
                 vs=evt.faction_vs,
                 xp=evt.experience_bonus,
-                timestamp=evt.timestamp.timestamp()
+                timestamp=timestamp
             )
 
-            # Convert to dictionary and json
-            dict_event = asdict(event_data)
-            json_event = json.dumps(event_data, indent=4, default=pydantic_encoder)
-
-            log.debug(dict_event)
-
-            # Publish to RabbitMQ
-            if RABBITMQ_ENABLED == 'True':
-                await rabbit.publish(bytes(json_event, encoding='utf-8'))
-                log.info(f'Event {unique_id} published')
-            # Add or remove from database
-            if evt.metagame_event_state_name == 'started':
-                result = await alert.create(dict_event)
+            # orjson serializes the dataclass straight to bytes
+            payload = orjson.dumps(event_data)
 
-                log.info(f'Created alert {unique_id}')
-                log.debug(result)
-            elif evt.metagame_event_state_name == 'ended' or 'cancelled':
-                await alert.remove(event_id=unique_id)
+            if log.isEnabledFor(logging.DEBUG):
+                pretty_event = orjson.dumps(event_data, option=orjson.OPT_INDENT_2)
+                log.debug('ESS Data: %s', pretty_event.decode())
 
-                log.info(f'Removed alert {unique_id}')
+            # Publishing and the database update are independent, run them concurrently
+            tasks = [publish_event(unique_id, payload)]
+            state_handler = STATE_HANDLERS.get(evt.metagame_event_state_name)
+            if state_handler is not None:
+                tasks.append(state_handler(unique_id, payload))
+            await asyncio.gather(*tasks)
 
         _ = on_metagame_event
 
@@ -170,9 +199,20 @@ async def main() -> None:
 if __name__ == '__main__':
     try:
         start_http_server(port=int(METRICS_PORT))
-        log.info(f'Metrics service listening on port {METRICS_PORT}')
+        log.info('Metrics service listening on port %s', METRICS_PORT)
+        if uvloop is not None:
+            asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
         loop = asyncio.new_event_loop()
-        loop.create_task(main())
+        main_task = loop.create_task(main())
+
+        def stop_on_failure(task: asyncio.Task) -> None:
+            # A failed startup stops the loop, so the process exits and Docker restarts it
+            if not task.cancelled() and task.exception() is not None:
+                loop.stop()
+
+        main_task.add_done_callback(stop_on_failure)
         loop.run_forever()
+        log.critical('ESS client failed to start', exc_info=main_task.exception())
+        raise SystemExit(1)
     except KeyboardInterrupt:
         pass
@@ -1,4 +1,18 @@
+import asyncio
+
+import bson
+from bson.raw_bson import RawBSONDocument
 from motor import motor_asyncio
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from pymongo.errors import BulkWriteError, DuplicateKeyError, WriteConcernError, WriteError
+from pymongo.operations import DeleteOne, InsertOne
+from pymongo.results import BulkWriteResult
+
+
+def _write_error(error: dict) -> WriteError:
+    """Builds the error insert_one would have raised for one failed document"""
+    error_class = DuplicateKeyError if error.get('code') == 11000 else WriteError
+    return error_class(error.get('errmsg'), error.get('code'), error)
 
 
 class Alert:
@@ -7,33 +21,166 @@ class Alert:
         self._client = None
         self._db = None
         self._alert_collection = None
+        self._insert_queue = None
+        self._insert_task = None
+        self._max_batch = 500
+        self._flush_interval = 0.05
         self.is_ready = False
+        self._setup_lock = asyncio.Lock()
 
-    async def setup(self, mongodb_url: str, db: str, collection: str):
+    async def setup(
+            self,
+            mongodb_url: str,
+            db: str,
+            collection: str,
+            max_pool_size: int = 20,
+            min_pool_size: int = 5,
+            max_batch: int = 500,
+            flush_interval: float = 0.05,
+            compressors: str = 'zlib',
+            server_selection_timeout_ms: int = 30_000,
+    ):
         """Creates a MongoDB client
 
         Args:
             - mongodb_url: `str` MongoDB connection URL
             - db: `str` Mongo database name
             - collection: `str` Mongo collection name
+            - max_pool_size: `int` (optional) maximum number of pooled connections
+            - min_pool_size: `int` (optional) connections kept open while idle
+            - max_batch: `int` (optional) maximum number of documents per insert batch
+            - flush_interval: `float` (optional) seconds to collect documents before inserting
+            - compressors: `str` (optional) comma separated wire compressors in order of
+              preference, zstd and snappy also need the zstandard/python-snappy packages
+            - server_selection_timeout_ms: `int` (optional) milliseconds to wait for a
+              reachable server before an operation fails, same as the driver default
         """
-        self._client = motor_asyncio.AsyncIOMotorClient(mongodb_url)
-        self._db = self._client[db]
-        self._alert_collection = self._db[collection]
+        # Concurrent callers wait here instead of creating a second client
+        async with self._setup_lock:
+            if self.is_ready:
+                return
+
+            # w=1 without journaling matches the non-persistent RabbitMQ messages,
+            # alerts can be rebuilt from Census so neither end waits on disk
+            client = motor_asyncio.AsyncIOMotorClient(
+                mongodb_url,
+                maxPoolSize=max_pool_size,
+                minPoolSize=min_pool_size,
+                w=1,
+                journal=False,
+                retryWrites=True,
+                serverSelectionTimeoutMS=server_selection_timeout_ms,
+                compressors=compressors,
+                zlibCompressionLevel=-1,
+            )
+            alert_collection = client[db][collection]
+
+            # Indexes for the queries Alert runs, existing indexes are left untouched
+            try:
+                await alert_collection.create_indexes([
+                    IndexModel([('id', ASCENDING)]),
+                    IndexModel([('timestamp', ASCENDING)]),
+                    IndexModel([('world_id', ASCENDING), ('timestamp', DESCENDING)]),
+                ])
+            except BaseException:
+                # Don't leak the client, the next setup() call creates a new one
+                client.close()
+                raise
 
-        self.is_ready = True
+            self._client = client
+            self._db = client[db]
+            self._alert_collection = alert_collection
+
+            self._max_batch = max_batch
+            self._flush_interval = flush_interval
+            self._insert_queue = asyncio.Queue()
+            self._insert_task = asyncio.create_task(self._flush_inserts())
+
+            self.is_ready = True
 
     async def create(self, event_data: dict):
         """Creates a new MetagameEvent instance in the database
 
+        The document is queued and inserted together with any other documents
+        created within `flush_interval`.
+
         Args:
             event_data: `dict` Dictionary containing event data
 
         Returns:
             inserted_id: `Any` ID of the created document
         """
-        result = await self._alert_collection.insert_one(event_data)
-        return result.inserted_id
+        # Encoding here raises InvalidDocument to this caller, not the whole batch
+        document = self._encode(event_data)
+        future = asyncio.get_running_loop().create_future()
+        self._insert_queue.put_nowait((document, future))
+        return await future
+
+    async def create_many(self, events: list[dict]) -> list:
+        """Creates many MetagameEvent instances in the database in one round-trip
+
+        Args:
+            events: `list[dict]` list of dictionaries containing event data
+
+        Returns:
+            inserted_ids: `list[Any]` IDs of the created documents, in order
+        """
+        documents = [self._encode(event_data) for event_data in events]
+        await self._alert_collection.insert_many(documents, ordered=False)
+        return [event_data['_id'] for event_data in events]
+
+    def _encode(self, event_data: dict) -> RawBSONDocument:
+        """Encodes a document to BSON once, before it is queued or inserted
+
+        PyMongo does not assign or report an _id for raw documents, so it is set
+        here like insert_one would.
+        """
+        event_data.setdefault('_id', bson.ObjectId())
+        codec_options = self._alert_collection.codec_options
+        raw = bson.encode(event_data, check_keys=False, codec_options=codec_options)
+        return RawBSONDocument(raw)
+
+    async def _flush_inserts(self):
+        """Background task inserting queued documents in batches"""
+        while True:
+            batch = [await self._insert_queue.get()]
+            await asyncio.sleep(self._flush_interval)
+            while len(batch) < self._max_batch and not self._insert_queue.empty():
+                batch.append(self._insert_queue.get_nowait())
+
+            # Each caller only gets an error for its own document, like insert_one
+            results = {}
+            try:
+                await self._alert_collection.insert_many(
+                    [document for document, _ in batch], ordered=False,
+                )
+            except BulkWriteError as e:
+                # The insert is unordered, documents without a write error were stored
+                for error in e.details.get('writeErrors', []):
+                    results[error['index']] = _write_error(error)
+                concern_errors = e.details.get('writeConcernErrors')
+                for index, (document, _) in enumerate(batch):
+                    if index in results:
+                        continue
+                    if concern_errors:
+                        error = concern_errors[0]
+                        results[index] = WriteConcernError(
+                            error.get('errmsg'), error.get('code'), error,
+                        )
+                    else:
+                        results[index] = document['_id']
+            except Exception as e:
+                results = dict.fromkeys(range(len(batch)), e)
+            else:
+                results = {index: document['_id'] for index, (document, _) in enumerate(batch)}
+
+            for index, (_, future) in enumerate(batch):
+                if future.done():
+                    continue
+                if isinstance(results[index], Exception):
+                    future.set_exception(results[index])
+                else:
+                    future.set_result(results[index])
 
     async def read_one(self, event_id: str) -> dict:
         """Reads one alert from the database
@@ -47,34 +194,56 @@ class Alert:
         result = await self._alert_collection.find_one({"id": event_id})
         return result
 
-    async def read_many(self, length: int, query: dict = None) -> list[dict]:
+    async def read_many(
+            self,
+            length: int | None,
+            query: dict = None,
+            projection: dict = None,
+    ) -> list[dict]:
         """Reads many alerts from the database
 
         Args:
-            length: `int` number of documents to return
+            length: `int | None` number of documents to return, all matches if None
             query: `dict` (optional) a Mongo query
+            projection: `dict` (optional) fields to return, all fields if omitted
 
         Returns:
             `list[dict]` list of documents
         """
-        cursor = self._alert_collection.find(query)
-        found_documents = []
-        for document in await cursor.to_list(length=length):
-            found_documents.append(document)
-        return found_documents
+        # A batch size of 0 leaves the batching to the server when there is no limit
+        batch_size = min(length, 1000) if length else 0
+        cursor = self._alert_collection.find(query, projection, batch_size=batch_size)
+        return await cursor.to_list(length=length)
 
     async def count(self, query: dict = None) -> int:
         """Get the number of alerts currently in the database
 
+        Without a query, the count is read from the collection metadata instead
+        of scanning the collection.
+
         Args:
             query: `dict` (optional) a Mongo query
 
         Returns:
             `int` number of documents in alert collection
         """
+        if query is None:
+            return await self._alert_collection.estimated_document_count()
         result = await self._alert_collection.count_documents(query)
         return result
 
+    async def count_world(self, world_id: int) -> int:
+        """Get the number of alerts currently in the database for a world
+
+        Args:
+            world_id: `int` ID of the world
+
+        Returns:
+            `int` number of documents for the world in alert collection
+        """
+        result = await self._alert_collection.count_documents({'world_id': world_id})
+        return result
+
     async def remove(self, event_id: str) -> int:
         """Remove a MetagameEvent instance from the database
 
@@ -98,3 +267,18 @@ class Alert:
         """
         result = await self._alert_collection.delete_many(query)
         return result.deleted_count
+
+    async def bulk(self, ops: list[InsertOne | DeleteOne]) -> BulkWriteResult:
+        """Apply many creates and removes in one round-trip
+
+        The writes are unordered, so the server may apply them in any order and
+        continues past individual failures.
+
+        Args:
+            ops: `list[InsertOne | DeleteOne]` write operations
+
+        Returns:
+            `BulkWriteResult` counts of the applied writes
+        """
+        result = await self._alert_collection.bulk_write(ops, ordered=False)
+        return result
@@ -1,35 +1,201 @@
-from aio_pika import DeliveryMode, ExchangeType, Message, connect
+import asyncio
+import logging
+from collections import deque
+from typing import Callable
+
+from aio_pika import DeliveryMode, ExchangeType, connect_robust
+from aiormq.exceptions import AMQPError
+from pamqp.commands import Basic
+
+log = logging.getLogger(__name__)
+
 
 class Rabbit:
     """Handles connecting and publishing events to RabbitMQ"""
     def __init__(self) -> None:
         self.is_ready = False
+        self.channel = None
+        self.rmq_conn = None
+        # Called with the connection when it closes or reconnects
+        self._close_callbacks: list[Callable] = []
+        self._reconnect_callbacks: list[Callable] = [self._on_reconnect]
+        self._setup_lock = asyncio.Lock()
+        self._replay_lock = asyncio.Lock()
+        # Messages published while the channel is closed, replayed once it reconnects
+        self._outbox = deque(maxlen=10_000)
+        self._routing_key = 'metagame'
+        self._transient_message_properties = {
+            'content_encoding': 'application/json',
+            'delivery_mode': DeliveryMode.NOT_PERSISTENT,
+        }
+        self._message_properties = self._transient_message_properties
+        self._durable_message_properties = {
+            'content_encoding': 'application/json',
+            'delivery_mode': DeliveryMode.PERSISTENT,
+        }
 
-    async def setup(self, rabbitmq_url: str):
+    async def setup(
+            self,
+            rabbitmq_url: str,
+            publisher_confirms: bool = False,
+            persistent: bool = False,
+    ):
         """Creates a RabbitMQ connection
 
+        The connection reconnects on its own after a broker outage, and messages
+        held while it was down are then published in order.
+
         Args:
             rabbitmq_url: :class:`str` RabbitMQ broker connection URL
+            publisher_confirms: :class:`bool` wait for a broker ack on every publish.
+                Disabled by default so publishing doesn't block on a round-trip.
+            persistent: :class:`bool` have the broker write published messages to disk.
+                Events can be replayed from Census, so this is disabled by default.
         """
-        self.rmq_conn = await connect(
-            url=rabbitmq_url,
-        )
-        self.channel = await self.rmq_conn.channel()
-        self.exchange = await self.channel.declare_exchange(
-            name='events',
-            type=ExchangeType.DIRECT,
-        )
-        self.is_ready = True
+        # Concurrent callers wait here instead of opening a second connection
+        async with self._setup_lock:
+            if self.is_ready:
+                return
+
+            self._message_properties = (
+                self._durable_message_properties if persistent
+                else self._transient_message_properties
+            )
+            self.rmq_conn = await connect_robust(
+                url=rabbitmq_url,
+            )
+            for callback in self._close_callbacks:
+                self.rmq_conn.close_callbacks.add(callback)
+            for callback in self._reconnect_callbacks:
+                self.rmq_conn.reconnect_callbacks.add(callback)
+            self.channel = await self.rmq_conn.channel(publisher_confirms=publisher_confirms)
+            self.exchange = await self.channel.declare_exchange(
+                name='events',
+                type=ExchangeType.DIRECT,
+            )
+            self.is_ready = True
+
+            # Messages published before setup went to the outbox
+            await self._replay_outbox()
+
+    def add_state_callbacks(self, on_close: Callable, on_reconnect: Callable):
+        """Registers callbacks for when the connection closes and reconnects
 
-    async def publish(self, message: bytes):
+        Callbacks added before :meth:`setup` are registered once it connects.
+
+        Args:
+            on_close: :class:`Callable` called when the connection is lost
+            on_reconnect: :class:`Callable` called once the connection is restored
+        """
+        self._close_callbacks.append(on_close)
+        self._reconnect_callbacks.append(on_reconnect)
+        if self.rmq_conn is not None:
+            self.rmq_conn.close_callbacks.add(on_close)
+            self.rmq_conn.reconnect_callbacks.add(on_reconnect)
+
+    async def publish(self, message: bytes) -> bool:
         """Publishes a message to the exchange
 
         Args:
             message: :class:`bytes` message in bytes
+
+        Returns:
+            :class:`bool` True if published, False if held until the channel reconnects
+        """
+        return await self._publish(message, self._message_properties)
+
+    async def publish_durable(self, message: bytes) -> bool:
+        """Publishes a message to the exchange that the broker persists to disk
+
+        Args:
+            message: :class:`bytes` message in bytes
+
+        Returns:
+            :class:`bool` True if published, False if held until the channel reconnects
+        """
+        return await self._publish(message, self._durable_message_properties)
+
+    def _is_channel_closed(self) -> bool:
+        return self.channel is None or self.channel.is_closed
+
+    async def _publish(self, message: bytes, properties: dict) -> bool:
+        # Hold messages while the channel is down instead of failing inside aio-pika
+        if self._is_channel_closed():
+            self._hold(message, properties)
+            return False
+
+        # Anything held from an outage goes out before this message
+        if self._outbox:
+            await self._replay_outbox()
+            if self._outbox:
+                self._hold(message, properties)
+                return False
+
+        try:
+            await self._send(message, properties)
+        except (AMQPError, ConnectionError):
+            # The channel dropped mid-publish, keep the message like a failed replay does
+            log.exception('Failed to publish message')
+            self._hold(message, properties)
+            return False
+        return True
+
+    def _hold(self, message: bytes, properties: dict):
+        if len(self._outbox) == self._outbox.maxlen:
+            log.warning('RabbitMQ outbox is full, dropping the oldest held message')
+        self._outbox.append((message, properties))
+        log.warning('RabbitMQ channel is closed, holding message (%s held)', len(self._outbox))
+
+    async def _replay_outbox(self):
+        """Publishes held messages in order, stopping at the first failure"""
+        async with self._replay_lock:
+            replayed = 0
+            while self._outbox and not self._is_channel_closed():
+                message, properties = self._outbox.popleft()
+                try:
+                    await self._send(message, properties)
+                except Exception:
+                    # Keep it at the front, it is retried on the next publish or reconnect
+                    self._outbox.appendleft((message, properties))
+                    log.exception(
+                        'Failed to replay held message, %s message(s) still held',
+                        len(self._outbox),
+                    )
+                    break
+                replayed += 1
+
+            if replayed:
+                log.info('Replayed %s held message(s)', replayed)
+
+    async def _on_reconnect(self, connection):
+        log.info('RabbitMQ connection restored')
+        await self._replay_outbox()
+
+    async def _send(self, message: bytes, properties: dict):
+        # Publish on the underlying aiormq channel, building the pamqp properties
+        # directly is much cheaper than wrapping every body in an aio_pika.Message
+        await self.channel.channel.basic_publish(
+            message,
+            exchange=self.exchange.name,
+            routing_key=self._routing_key,
+            properties=Basic.Properties(**properties),
+            mandatory=True,
+        )
+
+    async def publish_many(self, messages: list[bytes]) -> list:
+        """Publishes many messages to the exchange concurrently
+
+        With publisher confirms enabled, this waits for the broker to confirm the
+        whole batch at once instead of one message at a time.
+
+        Args:
+            messages: :class:`list[bytes]` messages in bytes
+
+        Returns:
+            :class:`list` result of :meth:`publish` or the raised exception for each
+            message, in order
         """
-        rmq_message = Message(
-            body=message,
-            content_encoding='application/json',
-            delivery_mode=DeliveryMode.PERSISTENT,
+        return await asyncio.gather(
+            *(self.publish(message) for message in messages),
+            return_exceptions=True,
         )
-        await self.exchange.publish(message=rmq_message, routing_key='metagame')
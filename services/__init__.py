@@ -3,8 +3,14 @@
 from .AlertService import Alert
 from .RabbitService import Rabbit
 
+# Process-wide instances, so every caller shares one Mongo pool and one AMQP connection
+alert = Alert()
+rabbit = Rabbit()
+
 
 __all__ = [
     'Alert',
     'Rabbit',
+    'alert',
+    'rabbit',
 ]
@@ -1,14 +1,29 @@
 import asyncio
 import logging
 import os
-from datetime import datetime
+import time
 
+import orjson
+
+from constants import models
 from constants.utils import CustomFormatter
-from services import Alert
+from services import alert, rabbit
 from constants.typings import UniqueEventId
 
+try:
+    import uvloop
+except ImportError:  # uvloop does not support Windows
+    uvloop = None
+
 MONGODB_URL = os.getenv('MONGODB_URL') or None
+RABBITMQ_ENABLED = os.getenv('RABBITMQ_ENABLED', 'False')
+RABBITMQ_URL = os.getenv('RABBITMQ_URL') or None
+
 
+# The simulator doesn't need thread or process info on its log records
+logging.logThreads = False
+logging.logProcesses = False
+logging.logMultiprocessing = False
 
 log = logging.getLogger('test')
 log.setLevel('INFO')
@@ -16,8 +31,29 @@ handler = logging.StreamHandler()
 handler.setFormatter(CustomFormatter())
 log.addHandler(handler)
 
+# Static fields of a simulated MetagameEvent, shared by every event
+EVENT_TEMPLATE = {
+    'event_id': 123,
+    'state': 'started',
+    'world_id': 17,
+    'zone_id': 1,
+    'nc': 40,
+    'tr': 30,
+    'vs': 20,
+    'xp': 25,
+}
 
-alert = Alert()
+
+async def publish_alert(id: str, payload: bytes):
+    if await rabbit.publish(payload):
+        log.info('Published alert %s', id)
+    else:
+        log.warning('Alert %s held until RabbitMQ reconnects', id)
+
+
+async def create_alert(event_data: dict):
+    c_result = await alert.create(event_data)
+    log.info('Created alert %s', c_result)
 
 
 async def create_and_remove_alert():
@@ -27,41 +63,41 @@ async def create_and_remove_alert():
             db='warpgate_dev',
             collection='alerts',
         )
+    if RABBITMQ_ENABLED == 'True' and not rabbit.is_ready:
+        await rabbit.setup(RABBITMQ_URL)
 
     log.info('Ready!')
 
     id = str(UniqueEventId(17, 123456))
 
-    # TODO: Use models.MetagameEvent instead of dict
-    event_data = {
-        '_id': id,
-        'event_id': 123,
-        'state': 'started',
-        'world_id': 17,
-        'zone_id': 1,
-        'nc': 40,
-        'tr': 30,
-        'vs': 20,
-        'xp': 25,
-        'timestamp': datetime.utcnow().timestamp()
-    }
-
-    # json_event = json.dumps(event_data)
+    event = models.MetagameEvent(id=id, timestamp=time.time(), **EVENT_TEMPLATE)
+    # Same payload ess_client publishes for real events, orjson returns bytes
+    payload = orjson.dumps(event)
 
-    c_result = await alert.create(event_data)
-    log.info(f'Created alert {c_result}')
+    # _id is only for the Mongo document, it is not part of the published event
+    event_data = orjson.loads(payload)
+    event_data['_id'] = id
+
+    # Publishing and the insert are independent, run them concurrently like ess_client
+    tasks = [create_alert(event_data)]
+    if RABBITMQ_ENABLED == 'True':
+        tasks.append(publish_alert(id, payload))
+    await asyncio.gather(*tasks)
 
+    # Count only after the insert has landed, so the logged total includes it
     count = await alert.count()
-    log.info(f'Alerts in database: {count}')
+    log.info('Alerts in database: %s', count)
 
     await asyncio.sleep(20)
 
     r_result = await alert.remove(id)
-    log.info(f'Removed {r_result} alert(s)')
+    log.info('Removed %s alert(s)', r_result)
 
     count = await alert.count()
-    log.info(f'Alerts in database: {count}')
+    log.info('Alerts in database: %s', count)
 
 
 if __name__ == '__main__':
+    if uvloop is not None:
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
     asyncio.run(create_and_remove_alert())
@@ -0,0 +1,213 @@
+import asyncio
+
+import pytest
+from bson.codec_options import CodecOptions
+from bson.errors import InvalidDocument
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+from services import AlertService
+from services.AlertService import Alert
+
+
+class FakeCollection:
+    codec_options = CodecOptions()
+
+    def __init__(self) -> None:
+        self.documents = {}
+        self.batches = []
+        self.fail_with = None
+
+    async def create_indexes(self, indexes):
+        if FakeClient.fail_indexes:
+            FakeClient.fail_indexes = False
+            raise ConnectionError('mongo unreachable')
+        self.indexes = indexes
+
+    def find(self, query, projection, batch_size):
+        self.batch_size = batch_size
+        return FakeCursor(list(self.documents.values()))
+
+    async def insert_many(self, documents, ordered):
+        if self.fail_with is not None:
+            raise self.fail_with
+        self.batches.append(len(documents))
+
+        errors = []
+        for index, raw in enumerate(documents):
+            document = dict(raw)
+            if document['_id'] in self.documents:
+                errors.append({'index': index, 'code': 11000, 'errmsg': 'E11000 duplicate key'})
+            else:
+                self.documents[document['_id']] = document
+        if errors:
+            raise BulkWriteError({
+                'writeErrors': errors,
+                'writeConcernErrors': [],
+                'nInserted': len(documents) - len(errors),
+            })
+
+
+class FakeCursor:
+    def __init__(self, documents: list) -> None:
+        self.documents = documents
+
+    async def to_list(self, length):
+        return self.documents if length is None else self.documents[:length]
+
+
+class FakeDatabase:
+    def __init__(self, collection: FakeCollection) -> None:
+        self.collection = collection
+
+    def __getitem__(self, name):
+        return self.collection
+
+
+class FakeClient:
+    instances = []
+    fail_indexes = False
+
+    def __init__(self, *args, **kwargs) -> None:
+        self.collection = FakeCollection()
+        self.closed = False
+        FakeClient.instances.append(self)
+
+    def __getitem__(self, name):
+        return FakeDatabase(self.collection)
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture(autouse=True)
+def fake_client(monkeypatch):
+    FakeClient.instances = []
+    FakeClient.fail_indexes = False
+    monkeypatch.setattr(AlertService.motor_asyncio, 'AsyncIOMotorClient', FakeClient)
+    return FakeClient
+
+
+async def ready_alert(**kwargs) -> Alert:
+    alert = Alert()
+    await alert.setup(mongodb_url='mongodb://test', db='test', collection='alerts', **kwargs)
+    return alert
+
+
+def test_concurrent_creates_share_one_insert():
+    async def scenario():
+        alert = await ready_alert()
+        ids = await asyncio.gather(*(alert.create({'_id': i}) for i in range(3)))
+
+        assert ids == [0, 1, 2]
+        assert FakeClient.instances[0].collection.batches == [3]
+
+    asyncio.run(scenario())
+
+
+def test_batches_are_capped_at_max_batch():
+    async def scenario():
+        alert = await ready_alert(max_batch=2, flush_interval=0)
+        await asyncio.gather(*(alert.create({'_id': i}) for i in range(5)))
+
+        assert FakeClient.instances[0].collection.batches == [2, 2, 1]
+
+    asyncio.run(scenario())
+
+
+def test_write_error_only_fails_its_own_document():
+    async def scenario():
+        alert = await ready_alert()
+        collection = FakeClient.instances[0].collection
+        await alert.create({'_id': 'dup'})
+
+        duplicate, stored = await asyncio.gather(
+            alert.create({'_id': 'dup'}),
+            alert.create({'_id': 'new'}),
+            return_exceptions=True,
+        )
+
+        assert isinstance(duplicate, DuplicateKeyError)
+        assert stored == 'new'
+        assert 'new' in collection.documents
+
+    asyncio.run(scenario())
+
+
+def test_invalid_document_only_fails_its_own_document():
+    async def scenario():
+        alert = await ready_alert()
+        collection = FakeClient.instances[0].collection
+
+        stored, invalid = await asyncio.gather(
+            alert.create({'_id': 'ok'}),
+            alert.create({'_id': 'bad', 'v': {1, 2}}),
+            return_exceptions=True,
+        )
+
+        assert stored == 'ok'
+        assert isinstance(invalid, InvalidDocument)
+        assert list(collection.documents) == ['ok']
+
+    asyncio.run(scenario())
+
+
+def test_failed_batch_fails_every_document():
+    async def scenario():
+        alert = await ready_alert()
+        FakeClient.instances[0].collection.fail_with = ConnectionError('mongo unreachable')
+
+        results = await asyncio.gather(
+            alert.create({'_id': 'a'}),
+            alert.create({'_id': 'b'}),
+            return_exceptions=True,
+        )
+
+        assert all(isinstance(result, ConnectionError) for result in results)
+
+    asyncio.run(scenario())
+
+
+def test_read_many_without_length_returns_everything():
+    async def scenario():
+        alert = await ready_alert()
+        collection = FakeClient.instances[0].collection
+        await asyncio.gather(*(alert.create({'_id': i}) for i in range(3)))
+
+        assert len(await alert.read_many(None)) == 3
+        assert collection.batch_size == 0
+        assert len(await alert.read_many(2)) == 2
+        assert collection.batch_size == 2
+
+    asyncio.run(scenario())
+
+
+def test_failed_setup_closes_its_client():
+    async def scenario():
+        alert = Alert()
+        FakeClient.fail_indexes = True
+        with pytest.raises(ConnectionError):
+            await alert.setup(mongodb_url='mongodb://test', db='test', collection='alerts')
+
+        assert not alert.is_ready
+        assert alert._client is None
+        assert FakeClient.instances[0].closed
+
+        await alert.setup(mongodb_url='mongodb://test', db='test', collection='alerts')
+        assert alert.is_ready
+        assert alert._client is FakeClient.instances[1]
+        assert not FakeClient.instances[1].closed
+
+    asyncio.run(scenario())
+
+
+def test_concurrent_setup_creates_one_client():
+    async def scenario():
+        alert = Alert()
+        await asyncio.gather(*(
+            alert.setup(mongodb_url='mongodb://test', db='test', collection='alerts')
+            for _ in range(3)
+        ))
+
+        assert len(FakeClient.instances) == 1
+
+    asyncio.run(scenario())
@@ -0,0 +1,205 @@
+import asyncio
+import inspect
+import logging
+
+import pytest
+from aio_pika import DeliveryMode
+
+from services import RabbitService
+from services.RabbitService import Rabbit
+
+
+class FakeUnderlayChannel:
+    def __init__(self) -> None:
+        self.published = []
+        self.fail = False
+
+    async def basic_publish(self, body, *, exchange, routing_key, properties, mandatory):
+        if self.fail:
+            raise ConnectionError('broker unreachable')
+        self.published.append(body)
+
+
+class FakeExchange:
+    def __init__(self, name: str) -> None:
+        self.name = name
+
+
+class FakeChannel:
+    def __init__(self) -> None:
+        self.is_closed = False
+        self.channel = FakeUnderlayChannel()
+
+    async def declare_exchange(self, name, type):
+        return FakeExchange(name)
+
+
+class FakeCallbacks(set):
+    async def __call__(self, *args):
+        # Like aio-pika, callbacks may be plain functions or coroutines
+        for callback in self:
+            result = callback(*args)
+            if inspect.isawaitable(result):
+                await result
+
+
+class FakeConnection:
+    def __init__(self) -> None:
+        self.fake_channel = FakeChannel()
+        self.close_callbacks = FakeCallbacks()
+        self.reconnect_callbacks = FakeCallbacks()
+
+    async def channel(self, publisher_confirms):
+        return self.fake_channel
+
+
+@pytest.fixture
+def connection(monkeypatch):
+    fake = FakeConnection()
+
+    async def connect_robust(url):
+        return fake
+
+    monkeypatch.setattr(RabbitService, 'connect_robust', connect_robust)
+    return fake
+
+
+def test_publish_sends_when_channel_open(connection):
+    async def scenario():
+        rabbit = Rabbit()
+        await rabbit.setup('amqp://test')
+        assert await rabbit.publish(b'one') is True
+        assert connection.fake_channel.channel.published == [b'one']
+
+    asyncio.run(scenario())
+
+
+def test_publish_before_setup_is_replayed_by_setup(connection):
+    async def scenario():
+        rabbit = Rabbit()
+        assert await rabbit.publish(b'early') is False
+        await rabbit.setup('amqp://test')
+        assert connection.fake_channel.channel.published == [b'early']
+        assert not rabbit._outbox
+
+    asyncio.run(scenario())
+
+
+def test_closed_channel_holds_message_and_warns(connection, caplog):
+    async def scenario():
+        rabbit = Rabbit()
+        await rabbit.setup('amqp://test')
+        connection.fake_channel.is_closed = True
+
+        with caplog.at_level(logging.WARNING):
+            assert await rabbit.publish(b'held') is False
+
+        assert connection.fake_channel.channel.published == []
+        assert list(rabbit._outbox)[0][0] == b'held'
+        assert 'holding message' in caplog.text
+
+    asyncio.run(scenario())
+
+
+def test_failed_send_holds_message(connection):
+    async def scenario():
+        rabbit = Rabbit()
+        await rabbit.setup('amqp://test')
+        underlay = connection.fake_channel.channel
+        underlay.fail = True
+
+        assert await rabbit.publish(b'lost') is False
+        assert [message for message, _ in rabbit._outbox] == [b'lost']
+
+        underlay.fail = False
+        assert await rabbit.publish(b'next') is True
+        assert underlay.published == [b'lost', b'next']
+
+    asyncio.run(scenario())
+
+
+def test_full_outbox_warns_when_dropping(connection, caplog):
+    async def scenario():
+        rabbit = Rabbit()
+        rabbit._outbox = type(rabbit._outbox)(maxlen=2)
+        for message in (b'1', b'2', b'3'):
+            with caplog.at_level(logging.WARNING):
+                await rabbit.publish(message)
+
+        assert [message for message, _ in rabbit._outbox] == [b'2', b'3']
+        assert 'dropping the oldest held message' in caplog.text
+
+    asyncio.run(scenario())
+
+
+def test_reconnect_replays_held_messages_in_order(connection):
+    async def scenario():
+        rabbit = Rabbit()
+        await rabbit.setup('amqp://test')
+        connection.fake_channel.is_closed = True
+        await rabbit.publish(b'first')
+        await rabbit.publish_durable(b'second')
+
+        connection.fake_channel.is_closed = False
+        await connection.reconnect_callbacks(connection)
+
+        assert connection.fake_channel.channel.published == [b'first', b'second']
+        assert not rabbit._outbox
+
+    asyncio.run(scenario())
+
+
+def test_failed_replay_keeps_message_and_logs(connection, caplog):
+    async def scenario():
+        rabbit = Rabbit()
+        await rabbit.setup('amqp://test')
+        underlay = connection.fake_channel.channel
+        connection.fake_channel.is_closed = True
+        await rabbit.publish(b'first')
+        await rabbit.publish(b'second')
+
+        connection.fake_channel.is_closed = False
+        underlay.fail = True
+        with caplog.at_level(logging.ERROR):
+            await connection.reconnect_callbacks(connection)
+
+        assert [message for message, _ in rabbit._outbox] == [b'first', b'second']
+        assert 'Failed to replay held message' in caplog.text
+
+        # The next publish flushes the held messages ahead of itself
+        underlay.fail = False
+        assert await rabbit.publish(b'third') is True
+        assert underlay.published == [b'first', b'second', b'third']
+
+    asyncio.run(scenario())
+
+
+def test_state_callbacks_follow_the_connection(connection):
+    async def scenario():
+        states = []
+        rabbit = Rabbit()
+        rabbit.add_state_callbacks(
+            on_close=lambda *_: states.append('stopped'),
+            on_reconnect=lambda *_: states.append('running'),
+        )
+        await rabbit.setup('amqp://test')
+
+        await connection.close_callbacks(connection, None)
+        await connection.reconnect_callbacks(connection)
+
+        assert states == ['stopped', 'running']
+
+    asyncio.run(scenario())
+
+
+def test_setup_persistent_flag_switches_both_ways(connection):
+    async def scenario():
+        rabbit = Rabbit()
+        await rabbit.setup('amqp://test', persistent=True)
+        assert rabbit._message_properties['delivery_mode'] == DeliveryMode.PERSISTENT
+
+        rabbit.is_ready = False
+        await rabbit.setup('amqp://test', persistent=False)
+        assert rabbit._message_properties['delivery_mode'] == DeliveryMode.NOT_PERSISTENT
+
+    asyncio.run(scenario())